@@ -0,0 +1,554 @@
+"""
+Headless batch runner for catalog-scale try-on jobs.
+
+Reads a manifest of (person, clothes, params) rows from a CSV or JSONL file,
+runs the same segmentation -> VITON -> post-processing chain as
+test_full_pipeline in a process pool (one model copy per worker) and writes
+the results to an output directory.
+
+Rows are handed to workers in chunks. Inside each worker, image decode and
+encode overlap with model compute (see io_pipeline.StagedPipeline).
+Finished rows are appended to a checkpoint file as each chunk completes, so
+an interrupted job can be restarted with the same command and will skip
+everything that is already done.
+
+Usage:
+    python batch_tryon.py manifest.csv --output-dir results --workers 4
+"""
+import argparse
+import csv
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Add project root to path
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from io_pipeline import StagedPipeline
+from pipeline_metrics import PipelineMetrics, memory_footprint, peak_rss_bytes, peak_tensor_bytes
+
+# Optional post-processing steps a manifest row can switch off
+STEP_PARAMS = ('preserve_face', 'skin_tone', 'enhance')
+
+# Models and metrics owned by the current worker process (set by _init_worker)
+_worker_models = None
+_worker_metrics = PipelineMetrics(enabled=False)
+
+
+def load_manifest(path):
+    """
+    Load manifest rows from a CSV or JSONL file
+
+    Every row needs 'person' and 'clothes' image paths. Optional columns:
+    'id' (output file stem, defaults to the row number) and the boolean
+    step switches in STEP_PARAMS. Relative image paths are resolved
+    against the manifest's directory.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    if path.lower().endswith(('.jsonl', '.ndjson')):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for index, row in enumerate(rows):
+        if not row.get('person') or not row.get('clothes'):
+            raise ValueError(f"Manifest row {index + 1} needs 'person' and 'clothes'")
+
+        params = {name: _parse_bool(row.get(name, True)) for name in STEP_PARAMS}
+        jobs.append({
+            'id': str(row.get('id') or f"{index:06d}"),
+            'person': os.path.join(base_dir, row['person']),
+            'clothes': os.path.join(base_dir, row['clothes']),
+            'params': params,
+        })
+
+    ids = [job['id'] for job in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Manifest ids must be unique")
+
+    return jobs
+
+
+def _parse_bool(value):
+    """
+    Interpret CSV/JSON values such as 'false', '0' or False as booleans
+
+    Empty values (a blank CSV cell or JSON null) keep the step enabled.
+    """
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() not in ('0', 'false', 'no', 'off')
+    return bool(value)
+
+
+def load_checkpoint(path):
+    """
+    Return the set of job ids already recorded as done in the checkpoint file
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a truncated last line; that job reruns
+                continue
+            if entry.get('status') == 'done':
+                done.add(entry['id'])
+    return done
+
+
+def load_models(device):
+    """
+    Build the segmentation, VITON and image processing models
+    """
+    from utils.segmentation import HumanSegmentation
+    from utils.virtual_tryon import VITONModel
+    from utils.image_processing import ImageProcessor
+
+    return {
+        'segmentation': HumanSegmentation(device=device),
+        'viton': VITONModel(),
+        'processor': ImageProcessor(),
+    }
+
+
+def _init_worker(device, torch_threads, trace=False):
+    """
+    Prepare a worker process, loading its own models unless it inherited them
+    """
+    global _worker_models, _worker_metrics
+
+    _worker_metrics = PipelineMetrics(enabled=trace)
+
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    if _worker_models is None:
+        _worker_models = load_models(device)
+
+
+def _preload_shared_models(device):
+    """
+    Load the models in the parent so forked workers share them copy-on-write
+
+    Returns the multiprocessing context to build the pool with, or None when
+    fork is unavailable (e.g. Windows) and workers must load their own copy.
+    Only CPU models can be shared: CUDA cannot be re-initialised in a forked
+    child, so every worker would fail on its first GPU call.
+    """
+    global _worker_models
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print("Shared models need the 'fork' start method; loading one copy per worker instead")
+        return None
+
+    start = time.perf_counter()
+    _worker_models = load_models(device)
+    # Move everything loaded so far out of the garbage collector's reach so
+    # that collections in the workers do not write to (and copy) those pages
+    gc.freeze()
+    print(f"Loaded shared models in {time.perf_counter() - start:.2f}s")
+    return multiprocessing.get_context('fork')
+
+
+def _release_shared_models():
+    """
+    Undo _preload_shared_models once its pool has shut down
+
+    Otherwise a later run_batch in this process, possibly on another
+    device, would fork workers that skip loading and reuse these models.
+    """
+    global _worker_models
+
+    _worker_models = None
+    gc.unfreeze()
+
+
+def segment_person(models, person_img, metrics=None, trace=None):
+    """
+    Compute the (body_mask, clothing_mask) pair that every garment reuses
+    """
+    span = (metrics or _worker_metrics).span
+    with span('segment_clothing_regions', trace):
+        return models['segmentation'].segment_clothing_regions(person_img)
+
+
+def apply_garment(models, person_img, masks, clothes_img, params, metrics=None, trace=None):
+    """
+    Run virtual try-on and post-processing for one garment on a segmented person
+    """
+    viton_model = models['viton']
+    processor = models['processor']
+    span = (metrics or _worker_metrics).span
+    body_mask, clothing_mask = masks
+
+    with span('warp_clothes', trace):
+        warped_clothes = viton_model.warp_clothes(person_img, clothes_img)
+    with span('fuse_features', trace):
+        result_image = viton_model.fuse_features(
+            person_img, warped_clothes, body_mask, clothing_mask
+        )
+
+    if params.get('preserve_face', True):
+        with span('preserve_face_features', trace):
+            result_image = processor.preserve_face_features(person_img, result_image)
+    if params.get('skin_tone', True):
+        with span('maintain_skin_tone', trace):
+            result_image = processor.maintain_skin_tone(person_img, result_image, body_mask)
+    if params.get('enhance', True):
+        with span('enhance_realism', trace):
+            result_image = processor.enhance_realism(result_image, clothing_mask, body_mask)
+
+    return result_image
+
+
+def run_pipeline(models, person_img, clothes_img, params, metrics=None, trace=None):
+    """
+    Run segmentation, virtual try-on and post-processing on one image pair
+
+    Each stage is timed through metrics.span() when metrics is given, and
+    appended to trace when a list is passed.
+    """
+    masks = segment_person(models, person_img, metrics, trace)
+    return apply_garment(models, person_img, masks, clothes_img, params, metrics, trace)
+
+
+def run_variants(models, person_img, garments, metrics=None):
+    """
+    Try several garments on one person, segmenting the person only once
+
+    garments is a list of (clothes_img, params) pairs. Returns the result
+    images in the same order.
+    """
+    masks = segment_person(models, person_img, metrics)
+    return [apply_garment(models, person_img, masks, clothes_img, params, metrics)
+            for clothes_img, params in garments]
+
+
+def group_by_person(jobs):
+    """
+    Group jobs that share a person image, keeping first-appearance order
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job['person'], []).append(job)
+    return list(groups.values())
+
+
+def make_chunks(jobs, chunk_size):
+    """
+    Pack jobs into chunks of at most chunk_size, keeping same-person rows together
+
+    A person with more than chunk_size rows is split across chunks, and each
+    of those chunks segments the person once.
+    """
+    chunks, current = [], []
+    for group in group_by_person(jobs):
+        for i in range(0, len(group), chunk_size):
+            piece = group[i:i + chunk_size]
+            if current and len(current) + len(piece) > chunk_size:
+                chunks.append(current)
+                current = []
+            current.extend(piece)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _process_chunk(jobs, output_dir):
+    """
+    Worker entry point: process a chunk of manifest rows and save the results
+
+    Each row is its own StagedPipeline item, so decoding and JPEG encoding
+    of neighbouring rows overlap with the models. Segmentation runs lazily
+    on the inference thread: consecutive rows with the same person image
+    reuse the previous masks, and the segmentation time and trace belong
+    to the row that computed them. Every stage stores its exception on the
+    row instead of raising, so a failing row keeps its partial trace.
+    """
+    from PIL import Image
+
+    tracing = _worker_metrics.enabled
+    # Most recently decoded person image; rows arrive grouped by person
+    person_cache = {}
+    person_lock = threading.Lock()
+    # Masks of the most recently segmented person (inference thread only)
+    segmented = {'person': None, 'masks': None}
+
+    def load_person(path):
+        with person_lock:
+            if path in person_cache:
+                return person_cache[path]
+        person_img = Image.open(path).convert('RGB')
+        with person_lock:
+            person_cache.clear()
+            person_cache[path] = person_img
+        return person_img
+
+    def decode(job):
+        row = {'job': job, 'trace': [] if tracing else None, 'error': None,
+               'seconds': 0.0, 'output': None}
+        try:
+            with _worker_metrics.span('decode', row['trace']):
+                row['person'] = load_person(job['person'])
+                row['clothes'] = Image.open(job['clothes']).convert('RGB')
+        except Exception as e:
+            row['error'] = e
+        return row
+
+    def infer(row):
+        if row['error'] is not None:
+            return row
+        job = row['job']
+        start = time.perf_counter()
+        try:
+            if segmented['person'] != job['person']:
+                segmented['person'] = None
+                segmented['masks'] = segment_person(_worker_models, row['person'],
+                                                    trace=row['trace'])
+                segmented['person'] = job['person']
+            row['result'] = apply_garment(_worker_models, row['person'], segmented['masks'],
+                                          row['clothes'], job['params'], trace=row['trace'])
+        except Exception as e:
+            row['error'] = e
+        row['seconds'] = time.perf_counter() - start
+        # The images are no longer needed; keep queued rows small
+        row.pop('person', None)
+        row.pop('clothes', None)
+        return row
+
+    def encode(job, row):
+        if row['error'] is not None:
+            return row
+        output_path = os.path.join(output_dir, f"{job['id']}.jpg")
+        try:
+            with _worker_metrics.span('encode', row['trace']):
+                row.pop('result').save(output_path)
+            row['output'] = output_path
+        except Exception as e:
+            row['error'] = e
+        return row
+
+    ordered = [job for group in group_by_person(jobs) for job in group]
+    entries = []
+    for job, row, error in StagedPipeline(decode, infer, encode).run(ordered):
+        error = error or row['error']
+        if error is not None:
+            entry = {'id': job['id'], 'status': 'failed', 'error': str(error)}
+        else:
+            entry = {
+                'id': job['id'],
+                'status': 'done',
+                'output': row['output'],
+                'seconds': round(row['seconds'], 4),
+            }
+        if tracing and row is not None:
+            entry['trace'] = row['trace']
+        entries.append(entry)
+
+    if tracing and entries:
+        # Memory peaks belong to the worker process, not to any one row, so
+        # they are reported once per chunk rather than in the per-row trace
+        entries[-1]['pid'] = os.getpid()
+        entries[-1]['peak_rss_bytes'] = peak_rss_bytes()
+        entries[-1]['peak_tensor_bytes'] = peak_tensor_bytes()
+        # RSS counts shared model pages in every worker; PSS/USS do not
+        entries[-1]['memory'] = memory_footprint()
+    return entries
+
+
+def _summarise_worker_memory(worker_memory):
+    """
+    Average the largest PSS/USS seen per worker process, or None if unmeasured
+    """
+    if not worker_memory:
+        return None
+    count = len(worker_memory)
+    return {
+        'workers_seen': count,
+        'mean_pss_bytes': sum(m['pss'] for m in worker_memory.values()) // count,
+        'mean_uss_bytes': sum(m['uss'] for m in worker_memory.values()) // count,
+        'total_pss_bytes': sum(m['pss'] for m in worker_memory.values()),
+    }
+
+
+def run_batch(manifest, output_dir, workers=1, device='cpu', checkpoint=None, chunk_size=8,
+              trace=False, share_models=False):
+    """
+    Process every manifest row not yet in the checkpoint and report throughput
+
+    With trace=True every checkpoint entry, failed ones included, carries
+    its per-stage timings. The last entry of each chunk also carries the
+    worker's peak RSS and CUDA tensor memory so far (worker-wide, not per row).
+    The aggregated histograms are also written to <output_dir>/metrics.prom.
+    With share_models=True the weights are loaded once in this process and
+    the forked workers share them read-only instead of loading their own.
+    This is CPU only. With trace=True, each worker's PSS/USS is also
+    reported, and the summary is written to <output_dir>/summary.json.
+    """
+    if workers < 1 or chunk_size < 1:
+        raise ValueError("workers and chunk_size must be at least 1")
+    if share_models and device != 'cpu':
+        raise ValueError("share_models is only supported with device='cpu'")
+
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint = checkpoint or os.path.join(output_dir, 'checkpoint.jsonl')
+
+    jobs = load_manifest(manifest)
+    done = load_checkpoint(checkpoint)
+    pending = [job for job in jobs if job['id'] not in done]
+
+    print(f"Manifest rows: {len(jobs)}, already done: {len(jobs) - len(pending)}, "
+          f"to process: {len(pending)}")
+
+    stats = {'done': 0, 'failed': 0, 'skipped': len(jobs) - len(pending), 'busy_seconds': 0.0}
+    if not pending:
+        print("Nothing to do.")
+        return stats
+
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    metrics = PipelineMetrics(enabled=trace)
+    worker_memory = {}
+    mp_context = _preload_shared_models(device) if share_models else None
+    start = time.perf_counter()
+
+    try:
+        with open(checkpoint, 'a', encoding='utf-8') as log, ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(device, torch_threads, trace),
+        ) as pool:
+            chunks = make_chunks(pending, chunk_size)
+            futures = {pool.submit(_process_chunk, chunk, output_dir): chunk for chunk in chunks}
+
+            for future in as_completed(futures):
+                try:
+                    entries = future.result()
+                except Exception as e:
+                    # The worker itself died (e.g. model load failed); fail the whole chunk
+                    entries = [{'id': job['id'], 'status': 'failed', 'error': str(e)}
+                               for job in futures[future]]
+
+                for entry in entries:
+                    # Failed rows carry the trace up to and including the failing stage
+                    for stage in entry.get('trace') or []:
+                        metrics.observe(stage['stage'], stage['seconds'], stage['error'])
+                    metrics.record_memory(entry.get('peak_rss_bytes'),
+                                          entry.get('peak_tensor_bytes'))
+                    if entry.get('memory'):
+                        seen = worker_memory.setdefault(entry['pid'], {'pss': 0, 'uss': 0})
+                        seen['pss'] = max(seen['pss'], entry['memory']['pss'])
+                        seen['uss'] = max(seen['uss'], entry['memory']['uss'])
+
+                    if entry['status'] == 'done':
+                        stats['done'] += 1
+                        stats['busy_seconds'] += entry['seconds']
+                    else:
+                        stats['failed'] += 1
+                        print(f"✗ {entry['id']}: {entry['error']}")
+                    log.write(json.dumps(entry) + '\n')
+                log.flush()
+
+            # Measured while the workers are still alive, so pages shared with
+            # them are split between the processes instead of counted again
+            parent_memory = memory_footprint() if trace else None
+    finally:
+        if mp_context is not None:
+            _release_shared_models()
+
+    elapsed = time.perf_counter() - start
+    stats['wall_seconds'] = elapsed
+
+    print(f"\n{'='*50}")
+    print("BATCH SUMMARY")
+    print('='*50)
+    print(f"Processed: {stats['done']}, failed: {stats['failed']}, skipped: {stats['skipped']}")
+    print(f"Wall time: {elapsed:.2f}s with {workers} worker(s)")
+    if stats['done']:
+        print(f"Throughput: {stats['done'] / elapsed:.2f} images/sec")
+        print(f"Mean model time per image: {stats['busy_seconds'] / stats['done']:.2f}s")
+    print(f"Checkpoint: {checkpoint}")
+
+    if trace:
+        metrics_path = os.path.join(output_dir, 'metrics.prom')
+        with open(metrics_path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(metrics.render_prometheus())
+        snapshot = metrics.snapshot()
+        for stage, stage_stats in snapshot['stages'].items():
+            print(f"  {stage}: {stage_stats['sum'] / stage_stats['count']:.3f}s mean "
+                  f"over {stage_stats['count']} call(s)")
+        if snapshot['peak_rss_bytes']:
+            print(f"Peak worker RSS: {snapshot['peak_rss_bytes'] / 2**20:.0f} MB "
+                  f"(includes shared pages)")
+        if snapshot['peak_tensor_bytes']:
+            print(f"Peak worker tensor memory: {snapshot['peak_tensor_bytes'] / 2**20:.0f} MB")
+        stats['worker_memory'] = _summarise_worker_memory(worker_memory)
+        stats['parent_memory'] = parent_memory
+        if stats['worker_memory']:
+            print(f"Per-worker PSS: {stats['worker_memory']['mean_pss_bytes'] / 2**20:.0f} MB, "
+                  f"USS: {stats['worker_memory']['mean_uss_bytes'] / 2**20:.0f} MB "
+                  f"({stats['worker_memory']['workers_seen']} worker(s))")
+        print(f"Stage metrics: {metrics_path}")
+
+        summary_path = os.path.join(output_dir, 'summary.json')
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(stats, workers=workers, share_models=share_models), f, indent=2)
+
+    return stats
+
+
+def _positive_int(value):
+    """
+    argparse type for options that must be at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer, got {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def main():
+    """
+    Command-line entry point
+    """
+    parser = argparse.ArgumentParser(description="Run virtual try-on over a manifest of image pairs")
+    parser.add_argument('manifest', help="CSV or JSONL file with person/clothes rows")
+    parser.add_argument('--output-dir', default='batch_results', help="Directory for result images")
+    parser.add_argument('--workers', type=_positive_int, default=1, help="Number of worker processes")
+    parser.add_argument('--device', default='cpu', help="Device passed to HumanSegmentation")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <output-dir>/checkpoint.jsonl)")
+    parser.add_argument('--chunk-size', type=_positive_int, default=8,
+                        help="Rows handed to a worker at a time; results are checkpointed per chunk")
+    parser.add_argument('--trace', action='store_true',
+                        help="Record per-stage timings for every row and peak worker memory")
+    parser.add_argument('--share-models', action='store_true',
+                        help="Load the models once and share them with forked workers (CPU only)")
+    args = parser.parse_args()
+    if args.share_models and args.device != 'cpu':
+        parser.error("--share-models is only supported with --device cpu")
+
+    stats = run_batch(args.manifest, args.output_dir, args.workers, args.device,
+                      args.checkpoint, args.chunk_size, args.trace, args.share_models)
+    sys.exit(1 if stats['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
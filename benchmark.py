@@ -0,0 +1,343 @@
+"""
+Reproducible benchmark suite for the Clothes Change Application.
+
+Generates deterministic synthetic person/clothes images (the same figure
+that create_sample_images in test_app.py draws, scaled to each resolution).
+Each pipeline module then runs several times per resolution, and the
+script records latency percentiles, throughput and peak memory.
+
+Results are written as JSON so that runs from two commits can be compared:
+
+    python benchmark.py --output bench_before.json
+    git checkout <other commit>
+    python benchmark.py --output bench_after.json --compare bench_before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Add project root to path
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from batch_tryon import _positive_int
+from pipeline_metrics import current_rss_bytes, high_water_rss_bytes, reset_peak_rss
+
+# (width, height) of the synthetic person images, portrait orientation
+RESOLUTIONS = {
+    '400x600': (400, 600),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+    '1440p': (1440, 2560),
+    '4k': (2160, 3840),
+}
+
+MODULES = (
+    'segment_human',
+    'segment_clothing_regions',
+    'warp_clothes',
+    'fuse_features',
+    'basic_clothes_replacement',
+    'preserve_face_features',
+    'maintain_skin_tone',
+    'enhance_realism',
+)
+
+
+def create_synthetic_inputs(width, height):
+    """
+    Draw the test_app.py sample person at the given size, plus matching masks
+
+    The drawing is scaled from the 400x600 original, so every run and
+    every machine gets identical pixels.
+    """
+    sx, sy = width / 400, height / 600
+
+    def pt(x, y):
+        return int(round(x * sx)), int(round(y * sy))
+
+    person_np = np.full((height, width, 3), (173, 216, 230), dtype=np.uint8)  # lightblue
+    cv2.circle(person_np, pt(200, 150), int(round(50 * min(sx, sy))), (255, 255, 255), -1)  # Head
+    cv2.rectangle(person_np, pt(150, 200), pt(250, 400), (0, 0, 255), -1)  # Clothing
+    cv2.rectangle(person_np, pt(100, 250), pt(150, 350), (255, 255, 255), -1)  # Left arm
+    cv2.rectangle(person_np, pt(250, 250), pt(300, 350), (255, 255, 255), -1)  # Right arm
+    cv2.rectangle(person_np, pt(175, 400), pt(200, 550), (255, 255, 255), -1)  # Left leg
+    cv2.rectangle(person_np, pt(200, 400), pt(225, 550), (255, 255, 255), -1)  # Right leg
+
+    side = int(round(300 * min(sx, sy)))
+    clothes_img = Image.new('RGB', (side, side), color='green')
+
+    x0, y0 = pt(150, 100)
+    x1, y1 = pt(250, 200)
+    body_mask = np.zeros((height, width), dtype=bool)
+    body_mask[y0:y1, x0:x1] = True  # Face area, as in test_image_processing
+
+    x0, y0 = pt(150, 200)
+    x1, y1 = pt(250, 400)
+    clothing_mask = np.zeros((height, width), dtype=np.uint8)
+    clothing_mask[y0:y1, x0:x1] = 1
+
+    return {
+        'person': Image.fromarray(person_np),
+        'clothes': clothes_img,
+        'modified': Image.new('RGB', (width, height), color='yellow'),
+        'body_mask': body_mask,
+        'clothing_mask': clothing_mask,
+    }
+
+
+def build_cases(models, inputs):
+    """
+    Return {module name: zero-argument callable} for one set of inputs
+    """
+    segmentation = models['segmentation']
+    viton_model = models['viton']
+    tryon = models['tryon']
+    processor = models['processor']
+
+    person = inputs['person']
+    clothes = inputs['clothes']
+    modified = inputs['modified']
+    body_mask = inputs['body_mask']
+    clothing_mask = inputs['clothing_mask']
+
+    # fuse_features is timed on its own, so warp once up front
+    try:
+        warped_clothes = viton_model.warp_clothes(person, clothes)
+    except Exception as e:
+        warp_error = e
+
+        def fuse_features():
+            raise RuntimeError(f"warp_clothes failed: {warp_error}")
+    else:
+        def fuse_features():
+            return viton_model.fuse_features(person, warped_clothes, body_mask, clothing_mask)
+
+    return {
+        'segment_human': lambda: segmentation.segment_human(person),
+        'segment_clothing_regions': lambda: segmentation.segment_clothing_regions(person),
+        'warp_clothes': lambda: viton_model.warp_clothes(person, clothes),
+        'fuse_features': fuse_features,
+        'basic_clothes_replacement': lambda: tryon._basic_clothes_replacement(
+            person, clothes, clothing_mask
+        ),
+        'preserve_face_features': lambda: processor.preserve_face_features(
+            person, modified, body_mask
+        ),
+        'maintain_skin_tone': lambda: processor.maintain_skin_tone(person, modified, body_mask),
+        'enhance_realism': lambda: processor.enhance_realism(modified, clothing_mask, body_mask),
+    }
+
+
+def measure_memory(func):
+    """
+    Return the memory one call of func adds on top of what is already resident
+
+    RSS: the process high-water mark is reset right before the call (Linux
+    /proc/self/clear_refs), so earlier cases and model loading do not show
+    up. This includes torch tensors and other native allocations. CUDA: the
+    peak allocator statistics are reset the same way. Values are None where
+    the platform cannot measure them in isolation.
+    """
+    torch = sys.modules.get('torch')
+    cuda = torch is not None and torch.cuda.is_available()
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        tensor_before = torch.cuda.memory_allocated()
+
+    rss_before = current_rss_bytes() if reset_peak_rss() else None
+    func()
+    rss_peak = high_water_rss_bytes() if rss_before is not None else None
+
+    result = {
+        'peak_rss_delta_bytes': rss_peak - rss_before if rss_peak is not None else None,
+        'peak_tensor_delta_bytes': None,
+    }
+    if cuda:
+        torch.cuda.synchronize()
+        result['peak_tensor_delta_bytes'] = torch.cuda.max_memory_allocated() - tensor_before
+    return result
+
+
+def measure(func, repeats, warmup):
+    """
+    Time func and record its peak memory
+
+    Timing runs first, without any memory instrumentation. Two extra calls
+    then measure memory: one for the process-level peak (measure_memory)
+    and one under tracemalloc for the Python/NumPy heap, which cannot see
+    torch tensor allocations.
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    memory = measure_memory(func)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_alloc = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    samples = np.array(samples)
+    return dict(memory, **{
+        'repeats': repeats,
+        'mean_s': float(samples.mean()),
+        'p50_s': float(np.percentile(samples, 50)),
+        'p90_s': float(np.percentile(samples, 90)),
+        'p99_s': float(np.percentile(samples, 99)),
+        'min_s': float(samples.min()),
+        'throughput_per_s': float(repeats / samples.sum()),
+        'peak_python_alloc_bytes': int(peak_alloc),
+    })
+
+
+def environment_info():
+    """
+    Describe the machine and commit the results were produced on
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    info = {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+    }
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        info['torch'] = torch.__version__
+        info['torch_threads'] = torch.get_num_threads()
+    return info
+
+
+def run_benchmarks(resolutions, modules, repeats, warmup, device):
+    """
+    Benchmark every requested module at every requested resolution
+    """
+    # Checked up front: per-case failures are caught and recorded as FAILED
+    if repeats < 1 or warmup < 0:
+        raise ValueError("repeats must be at least 1 and warmup at least 0")
+
+    from utils.segmentation import HumanSegmentation
+    from utils.virtual_tryon import VirtualTryOn, VITONModel
+    from utils.image_processing import ImageProcessor
+
+    models = {
+        'segmentation': HumanSegmentation(device=device),
+        'viton': VITONModel(),
+        'tryon': VirtualTryOn(device=device),
+        'processor': ImageProcessor(),
+    }
+
+    results = []
+    for name in resolutions:
+        width, height = RESOLUTIONS[name]
+        cases = build_cases(models, create_synthetic_inputs(width, height))
+
+        for module in modules:
+            print(f"{name:>8} {module:<26}", end='', flush=True)
+            try:
+                stats = measure(cases[module], repeats, warmup)
+                print(f"p50 {stats['p50_s'] * 1000:9.1f} ms   "
+                      f"p99 {stats['p99_s'] * 1000:9.1f} ms   "
+                      f"{stats['throughput_per_s']:7.2f}/s")
+            except Exception as e:
+                stats = {'error': str(e)}
+                print(f"FAILED: {e}")
+
+            results.append(dict(stats, module=module, resolution=name, width=width, height=height))
+
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """
+    Print p50 changes against a previous results file and return regressions
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    previous = {(r['module'], r['resolution']): r for r in baseline['results'] if 'p50_s' in r}
+    regressions = []
+
+    print(f"\n{'='*50}")
+    print(f"COMPARISON WITH {baseline_path} (commit {baseline['environment'].get('commit')})")
+    print('='*50)
+    for result in results:
+        old = previous.get((result['module'], result['resolution']))
+        if old is None or 'p50_s' not in result:
+            continue
+        ratio = result['p50_s'] / old['p50_s']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- REGRESSION'
+            regressions.append(result)
+        print(f"{result['resolution']:>8} {result['module']:<26} "
+              f"{old['p50_s'] * 1000:9.1f} -> {result['p50_s'] * 1000:9.1f} ms  ({ratio:5.2f}x){flag}")
+
+    return regressions
+
+
+def main():
+    """
+    Command-line entry point
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the clothes change pipeline modules")
+    parser.add_argument('--resolutions', nargs='+', choices=list(RESOLUTIONS),
+                        default=list(RESOLUTIONS), help="Resolutions to run")
+    parser.add_argument('--modules', nargs='+', choices=MODULES, default=list(MODULES),
+                        help="Modules to run")
+    parser.add_argument('--repeats', type=_positive_int, default=10, help="Timed runs per case")
+    parser.add_argument('--warmup', type=int, default=2, help="Untimed runs per case")
+    parser.add_argument('--device', default='cpu', help="Device passed to the models")
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file")
+    parser.add_argument('--compare', help="Previous results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative p50 slowdown reported as a regression")
+    args = parser.parse_args()
+    if args.warmup < 0:
+        parser.error("--warmup must be at least 0")
+
+    results = run_benchmarks(args.resolutions, args.modules, args.repeats, args.warmup, args.device)
+
+    report = {
+        'environment': environment_info(),
+        'settings': {'repeats': args.repeats, 'warmup': args.warmup, 'device': args.device},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
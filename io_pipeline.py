@@ -0,0 +1,156 @@
+"""
+Staged I/O pipeline that overlaps image decode/encode with model compute.
+
+Decoding runs in one thread pool and encoding in another. Model inference
+runs on a single dedicated thread, because the models are not guaranteed to
+be thread-safe. That guarantee is per run() call: two concurrent run()
+calls (e.g. from parallel web requests) each get their own inference
+thread, so callers sharing one set of models must serialise the runs
+themselves. Bounded queues link the stages, so at most a few images are
+held in memory no matter how long the input is. While one image is inside
+the try-on models, the next one is already being decoded and the previous
+one is being written out. PIL and torch both release the GIL for most of
+that work.
+
+Example:
+    pipeline = StagedPipeline(load_pair, run_models, save_result)
+    for item, output, error in pipeline.run(jobs):
+        ...
+"""
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_DONE = object()
+
+# How often blocked stages re-check whether the consumer went away
+_POLL_SECONDS = 0.1
+
+
+class StagedPipeline:
+    """
+    Three-stage decode -> infer -> encode pipeline with backpressure
+    """
+
+    def __init__(self, decode_fn, infer_fn, encode_fn,
+                 decode_workers=2, encode_workers=2, queue_size=4):
+        """
+        Args:
+            decode_fn: Called as decode_fn(item) in the decode pool
+            infer_fn: Called as infer_fn(decoded) on the inference thread
+            encode_fn: Called as encode_fn(item, output) in the encode pool
+            decode_workers: Threads used for decoding
+            encode_workers: Threads used for encoding
+            queue_size: Maximum items waiting between two stages
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+
+        self.decode_fn = decode_fn
+        self.infer_fn = infer_fn
+        self.encode_fn = encode_fn
+        self.decode_workers = decode_workers
+        self.encode_workers = encode_workers
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """
+        Push items through all three stages
+
+        Yields (item, output, error) tuples in input order, where output is
+        what encode_fn returned. If any stage raised for that item, output
+        is None and error is the exception. A failure in one item does not
+        stop the others. Closing the generator early stops the stages after
+        the work already in flight.
+        """
+        stop = threading.Event()
+        decoded = queue.Queue(maxsize=self.queue_size)
+        encoded = queue.Queue(maxsize=self.queue_size)
+
+        with ThreadPoolExecutor(self.decode_workers) as decode_pool, \
+                ThreadPoolExecutor(self.encode_workers) as encode_pool:
+
+            def feed():
+                try:
+                    for item in items:
+                        if stop.is_set():
+                            return
+                        future = decode_pool.submit(self.decode_fn, item)
+                        if not _put(decoded, (item, future), stop):
+                            return
+                except Exception as e:
+                    # The input iterator itself failed; report it as a final entry
+                    _put(decoded, (None, _failed(e)), stop)
+                finally:
+                    _put(decoded, _DONE, stop)
+
+            def infer():
+                while True:
+                    entry = _get(decoded, stop)
+                    if entry is None or entry is _DONE:
+                        break
+                    item, future = entry
+                    try:
+                        output = self.infer_fn(future.result())
+                        future = encode_pool.submit(self.encode_fn, item, output)
+                    except Exception as e:
+                        future = _failed(e)
+                    if not _put(encoded, (item, future), stop):
+                        return
+                _put(encoded, _DONE, stop)
+
+            threads = [
+                threading.Thread(target=feed, name='pipeline-feed', daemon=True),
+                threading.Thread(target=infer, name='pipeline-infer', daemon=True),
+            ]
+            for thread in threads:
+                thread.start()
+
+            try:
+                while True:
+                    entry = encoded.get()
+                    if entry is _DONE:
+                        break
+                    item, future = entry
+                    try:
+                        yield item, future.result(), None
+                    except Exception as e:
+                        yield item, None, e
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+
+
+def _failed(error):
+    """
+    Return an already-completed future carrying the given exception
+    """
+    future = Future()
+    future.set_exception(error)
+    return future
+
+
+def _put(q, value, stop):
+    """
+    Put onto a bounded queue, giving up if the pipeline is stopping
+    """
+    while not stop.is_set():
+        try:
+            q.put(value, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """
+    Get from a queue, returning None if the pipeline is stopping
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return None
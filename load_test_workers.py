@@ -0,0 +1,108 @@
+"""
+Load test for batch_tryon.py across worker counts.
+
+Runs the same manifest with each requested --workers value, once with
+per-worker model copies and once with --share-models. Each run goes to a
+fresh output directory, so nothing is skipped from a checkpoint. The script
+prints throughput and memory per worker count. Memory is reported as
+PSS/USS, because RSS counts pages shared with other processes in every
+worker and so cannot show what sharing saves.
+
+Usage:
+    python load_test_workers.py manifest.csv --workers 1 2 4 --output load_test.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BATCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_tryon.py')
+
+
+def run_once(manifest, workers, share_models, chunk_size, device):
+    """
+    Run batch_tryon.py once and return the summary it wrote
+    """
+    with tempfile.TemporaryDirectory(prefix='load_test_') as output_dir:
+        command = [
+            sys.executable, BATCH_SCRIPT, manifest,
+            '--output-dir', output_dir,
+            '--workers', str(workers),
+            '--chunk-size', str(chunk_size),
+            '--device', device,
+            '--trace',
+        ]
+        if share_models:
+            command.append('--share-models')
+
+        completed = subprocess.run(command, capture_output=True, text=True)
+        summary_path = os.path.join(output_dir, 'summary.json')
+        if not os.path.exists(summary_path):
+            raise RuntimeError(f"batch_tryon.py failed:\n{completed.stdout}\n{completed.stderr}")
+        with open(summary_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+
+def _mb(value):
+    return f"{value / 2**20:8.0f}" if value is not None else f"{'n/a':>8}"
+
+
+def main():
+    """
+    Command-line entry point
+    """
+    parser = argparse.ArgumentParser(description="Sweep batch_tryon.py worker counts")
+    parser.add_argument('manifest', help="CSV or JSONL manifest passed to batch_tryon.py")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="Worker counts to try")
+    parser.add_argument('--chunk-size', type=int, default=1,
+                        help="Rows per chunk; small values spread rows over all workers")
+    parser.add_argument('--device', default='cpu', help="Device passed to the models")
+    parser.add_argument('--output', help="Optional JSON file for the results")
+    args = parser.parse_args()
+
+    if any(count < 1 for count in args.workers) or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size values must be at least 1")
+
+    # Shared models rely on fork, which CUDA does not survive
+    modes = [False, True] if args.device == 'cpu' else [False]
+
+    results = []
+    print(f"{'workers':>7} {'shared':>6} {'img/s':>8} {'PSS/wkr':>8} {'USS/wkr':>8} "
+          f"{'total PSS':>9} {'failed':>6}  (MB)")
+    for workers in args.workers:
+        for share_models in modes:
+            summary = run_once(args.manifest, workers, share_models, args.chunk_size, args.device)
+            worker_memory = summary.get('worker_memory') or {}
+            parent_memory = summary.get('parent_memory') or {}
+
+            throughput = summary['done'] / summary['wall_seconds'] if summary.get('wall_seconds') else 0.0
+            total_pss = None
+            if worker_memory.get('total_pss_bytes') is not None:
+                # The parent holds the shared copy of the weights in shared mode
+                total_pss = worker_memory['total_pss_bytes'] + (parent_memory.get('pss') or 0)
+
+            result = {
+                'workers': workers,
+                'share_models': share_models,
+                'images_per_sec': throughput,
+                'failed': summary['failed'],
+                'mean_pss_bytes': worker_memory.get('mean_pss_bytes'),
+                'mean_uss_bytes': worker_memory.get('mean_uss_bytes'),
+                'total_pss_bytes': total_pss,
+            }
+            results.append(result)
+            print(f"{workers:>7} {'yes' if share_models else 'no':>6} {throughput:8.2f} "
+                  f"{_mb(result['mean_pss_bytes'])} {_mb(result['mean_uss_bytes'])} "
+                  f" {_mb(total_pss)} {summary['failed']:>6}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Per-stage latency and memory instrumentation for the try-on pipeline.
+
+Wrap each stage in a span:
+
+    metrics = PipelineMetrics()
+    trace = []
+    with metrics.span('segmentation', trace):
+        body_mask, clothing_mask = segmentation.segment_clothing_regions(person_img)
+
+Every span adds to a per-stage latency histogram and error counter. It also
+updates the process's peak RSS and peak tensor memory. If a trace list is
+passed, a {'stage', 'seconds', 'error'} entry is appended to it, so the
+caller can return a per-request trace. render_prometheus() outputs everything
+in the Prometheus text format.
+
+With enabled=False, span() returns a shared no-op context manager, so
+instrumented code costs one attribute lookup per stage.
+"""
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def peak_rss_bytes():
+    """
+    Return the peak resident set size of this process in bytes, or None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _read_kb_fields(path, names):
+    """
+    Read 'Name:  123 kB' fields from a /proc file as bytes, or None if unavailable
+    """
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in names:
+                    values[name] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return values
+
+
+def current_rss_bytes():
+    """
+    Return the current resident set size in bytes (Linux only), or None
+    """
+    values = _read_kb_fields('/proc/self/status', ('VmRSS',))
+    return values.get('VmRSS') if values else None
+
+
+def high_water_rss_bytes():
+    """
+    Return the RSS high-water mark since start or the last reset_peak_rss()
+
+    Linux only; returns None elsewhere.
+    """
+    values = _read_kb_fields('/proc/self/status', ('VmHWM',))
+    return values.get('VmHWM') if values else None
+
+
+def reset_peak_rss():
+    """
+    Reset the RSS high-water mark to the current RSS (Linux only)
+
+    Returns True if the reset worked, so that high_water_rss_bytes() then
+    measures only what happens after this call.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def memory_footprint():
+    """
+    Return {'rss', 'pss', 'uss'} in bytes for this process, or None
+
+    PSS splits pages shared with other processes (e.g. model weights
+    inherited over fork) between them. USS counts only private pages. Both
+    show what one more worker really costs, which RSS does not. Read from
+    /proc/self/smaps_rollup, so Linux only.
+    """
+    values = _read_kb_fields('/proc/self/smaps_rollup',
+                             ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'))
+    if not values or 'Pss' not in values:
+        return None
+    return {
+        'rss': values.get('Rss'),
+        'pss': values['Pss'],
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def peak_tensor_bytes():
+    """
+    Return the peak CUDA tensor memory in bytes, or None when not on GPU
+
+    torch is only consulted if something else already imported it.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda.max_memory_allocated()
+
+
+class _NullSpan:
+    """
+    No-op span used when instrumentation is disabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """
+    Times one stage and reports it to PipelineMetrics on exit
+    """
+
+    def __init__(self, metrics, stage, trace):
+        self.metrics = metrics
+        self.stage = stage
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        error = exc_type is not None
+        self.metrics.observe(self.stage, seconds, error)
+        self.metrics.record_memory(peak_rss_bytes(), peak_tensor_bytes())
+        if self.trace is not None:
+            self.trace.append({'stage': self.stage, 'seconds': round(seconds, 6), 'error': error})
+        return False
+
+
+class PipelineMetrics:
+    """
+    Thread-safe per-stage latency histograms, error counters and memory peaks
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._stages = {}
+        # None until a value is recorded, so unmeasured gauges are left out
+        self._peak_rss = None
+        self._peak_tensor = None
+
+    def span(self, stage, trace=None):
+        """
+        Context manager that times a pipeline stage
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage, trace)
+
+    def observe(self, stage, seconds, error=False):
+        """
+        Record one stage duration, e.g. one measured in another process
+        """
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = {'count': 0, 'sum': 0.0, 'errors': 0, 'buckets': [0] * len(self.buckets)}
+                self._stages[stage] = stats
+
+            stats['count'] += 1
+            stats['sum'] += seconds
+            if error:
+                stats['errors'] += 1
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+                    break
+
+    def record_memory(self, rss_bytes=None, tensor_bytes=None):
+        """
+        Raise the recorded memory peaks to the given values if they are higher
+        """
+        with self._lock:
+            if rss_bytes is not None:
+                self._peak_rss = max(self._peak_rss or 0, rss_bytes)
+            if tensor_bytes is not None:
+                self._peak_tensor = max(self._peak_tensor or 0, tensor_bytes)
+
+    def snapshot(self):
+        """
+        Return a copy of the per-stage statistics and memory peaks
+
+        A peak is None when nothing was recorded for it, e.g. tensor memory
+        on a CPU-only run.
+        """
+        with self._lock:
+            return {
+                'stages': {stage: dict(stats, buckets=list(stats['buckets']))
+                           for stage, stats in self._stages.items()},
+                'peak_rss_bytes': self._peak_rss,
+                'peak_tensor_bytes': self._peak_tensor,
+            }
+
+    def render_prometheus(self, prefix='tryon'):
+        """
+        Render all metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each try-on pipeline stage",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for stage, stats in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats['buckets']):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+        lines.append(f"# HELP {prefix}_stage_errors_total Pipeline stages that raised an exception")
+        lines.append(f"# TYPE {prefix}_stage_errors_total counter")
+        for stage, stats in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {stats["errors"]}')
+
+        # Gauges nobody measured are omitted rather than reported as 0
+        if snapshot['peak_rss_bytes'] is not None:
+            lines.append(f"# HELP {prefix}_peak_rss_bytes Peak resident set size observed")
+            lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+            lines.append(f"{prefix}_peak_rss_bytes {snapshot['peak_rss_bytes']}")
+        if snapshot['peak_tensor_bytes'] is not None:
+            lines.append(f"# HELP {prefix}_peak_tensor_bytes Peak CUDA tensor memory observed")
+            lines.append(f"# TYPE {prefix}_peak_tensor_bytes gauge")
+            lines.append(f"{prefix}_peak_tensor_bytes {snapshot['peak_tensor_bytes']}")
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,249 @@
+"""
+Tests for the headless batch runner in batch_tryon.py
+"""
+import gc
+import json
+import multiprocessing
+import os
+
+import pytest
+
+import batch_tryon
+from batch_tryon import load_checkpoint, load_manifest, make_chunks
+from pipeline_metrics import PipelineMetrics
+
+
+def test_load_manifest_csv(tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        "id,person,clothes,preserve_face,skin_tone,enhance\n"
+        "a,people/p1.jpg,shirt.jpg,false,,1\n"
+        ",people/p2.jpg,dress.jpg,no,true,\n",
+        encoding='utf-8'
+    )
+
+    jobs = load_manifest(str(manifest))
+
+    assert [job['id'] for job in jobs] == ['a', '000001']
+    assert jobs[0]['person'] == str(tmp_path / 'people' / 'p1.jpg')
+    assert jobs[0]['clothes'] == str(tmp_path / 'shirt.jpg')
+    # A blank cell keeps the step enabled
+    assert jobs[0]['params'] == {'preserve_face': False, 'skin_tone': True, 'enhance': True}
+    assert jobs[1]['params'] == {'preserve_face': False, 'skin_tone': True, 'enhance': True}
+
+
+def test_load_manifest_jsonl(tmp_path):
+    manifest = tmp_path / 'manifest.jsonl'
+    rows = [
+        {'id': 'x', 'person': 'p.jpg', 'clothes': 'c.jpg', 'enhance': False},
+        {'id': 'y', 'person': 'p.jpg', 'clothes': 'd.jpg', 'skin_tone': None},
+    ]
+    manifest.write_text('\n'.join(json.dumps(row) for row in rows) + '\n\n', encoding='utf-8')
+
+    jobs = load_manifest(str(manifest))
+
+    assert [job['id'] for job in jobs] == ['x', 'y']
+    assert jobs[0]['params']['enhance'] is False
+    assert jobs[1]['params'] == {'preserve_face': True, 'skin_tone': True, 'enhance': True}
+
+
+def test_load_manifest_rejects_bad_rows(tmp_path):
+    missing = tmp_path / 'missing.csv'
+    missing.write_text("person,clothes\np.jpg,\n", encoding='utf-8')
+    with pytest.raises(ValueError, match="needs 'person' and 'clothes'"):
+        load_manifest(str(missing))
+
+    duplicate = tmp_path / 'duplicate.csv'
+    duplicate.write_text("id,person,clothes\na,p.jpg,c.jpg\na,q.jpg,d.jpg\n", encoding='utf-8')
+    with pytest.raises(ValueError, match="unique"):
+        load_manifest(str(duplicate))
+
+
+def test_load_checkpoint(tmp_path):
+    checkpoint = tmp_path / 'checkpoint.jsonl'
+    assert load_checkpoint(str(checkpoint)) == set()
+
+    checkpoint.write_text(
+        json.dumps({'id': 'a', 'status': 'done'}) + '\n'
+        + json.dumps({'id': 'b', 'status': 'failed', 'error': 'boom'}) + '\n'
+        + json.dumps({'id': 'c', 'status': 'done'}) + '\n'
+        + '{"id": "d", "sta',
+        encoding='utf-8'
+    )
+
+    assert load_checkpoint(str(checkpoint)) == {'a', 'c'}
+
+
+class _StubSegmentation:
+    def __init__(self):
+        self.calls = 0
+
+    def segment_clothing_regions(self, person_img):
+        self.calls += 1
+        return 'body', 'clothing'
+
+
+class _StubVITON:
+    """
+    Passes the garment through as the result; a pure red garment fails to warp
+    """
+
+    def warp_clothes(self, person_img, clothes_img):
+        if clothes_img.getpixel((0, 0)) == (255, 0, 0):
+            raise RuntimeError("warp failed")
+        return clothes_img
+
+    def fuse_features(self, person_img, warped_clothes, body_mask, clothing_mask):
+        return warped_clothes
+
+
+class _StubProcessor:
+    def preserve_face_features(self, person_img, result_image):
+        return result_image
+
+    def maintain_skin_tone(self, person_img, result_image, body_mask):
+        return result_image
+
+    def enhance_realism(self, result_image, clothing_mask, body_mask):
+        return result_image
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    models = {
+        'segmentation': _StubSegmentation(),
+        'viton': _StubVITON(),
+        'processor': _StubProcessor(),
+    }
+    monkeypatch.setattr(batch_tryon, '_worker_models', models)
+    monkeypatch.setattr(batch_tryon, '_worker_metrics', PipelineMetrics(enabled=True))
+    return models
+
+
+def _image(tmp_path, name, color):
+    Image = pytest.importorskip('PIL.Image')
+    path = tmp_path / name
+    Image.new('RGB', (8, 8), color).save(path)
+    return str(path)
+
+
+def _job(job_id, person, clothes):
+    return {'id': job_id, 'person': person, 'clothes': clothes,
+            'params': {name: True for name in batch_tryon.STEP_PARAMS}}
+
+
+def test_process_chunk_segments_each_person_once(tmp_path, stub_models):
+    alice = _image(tmp_path, 'alice.png', (200, 180, 160))
+    bob = _image(tmp_path, 'bob.png', (90, 70, 60))
+    green = _image(tmp_path, 'green.png', (0, 255, 0))
+    red = _image(tmp_path, 'red.png', (255, 0, 0))
+    blue = _image(tmp_path, 'blue.png', (0, 0, 255))
+    jobs = [_job('a1', alice, green), _job('b1', bob, green),
+            _job('a2', alice, red), _job('a3', alice, blue)]
+
+    entries = batch_tryon._process_chunk(jobs, str(tmp_path))
+
+    # Rows are regrouped by person, and the failed warp does not drop the masks
+    assert [entry['id'] for entry in entries] == ['a1', 'a2', 'a3', 'b1']
+    assert stub_models['segmentation'].calls == 2
+    assert [entry['status'] for entry in entries] == ['done', 'failed', 'done', 'done']
+    for entry in entries:
+        if entry['status'] == 'done':
+            assert os.path.exists(entry['output'])
+
+
+def test_process_chunk_failing_garment_keeps_partial_trace(tmp_path, stub_models):
+    alice = _image(tmp_path, 'alice.png', (200, 180, 160))
+    green = _image(tmp_path, 'green.png', (0, 255, 0))
+    red = _image(tmp_path, 'red.png', (255, 0, 0))
+
+    entries = batch_tryon._process_chunk(
+        [_job('ok', alice, green), _job('bad', alice, red)], str(tmp_path)
+    )
+
+    failed = entries[1]
+    assert failed['id'] == 'bad'
+    assert failed['error'] == 'warp failed'
+    assert not os.path.exists(tmp_path / 'bad.jpg')
+    # The masks came from the first row, so the trace stops at the failing warp
+    assert [stage['stage'] for stage in failed['trace']] == ['decode', 'warp_clothes']
+    assert failed['trace'][-1]['error'] is True
+    assert [stage['stage'] for stage in entries[0]['trace']][:2] == [
+        'decode', 'segment_clothing_regions'
+    ]
+
+
+def test_process_chunk_reports_worker_memory_once(tmp_path, stub_models, monkeypatch):
+    monkeypatch.setattr(batch_tryon, 'peak_tensor_bytes', lambda: 4096)
+    alice = _image(tmp_path, 'alice.png', (200, 180, 160))
+    green = _image(tmp_path, 'green.png', (0, 255, 0))
+    blue = _image(tmp_path, 'blue.png', (0, 0, 255))
+
+    entries = batch_tryon._process_chunk(
+        [_job('a1', alice, green), _job('a2', alice, blue)], str(tmp_path)
+    )
+
+    # Worker-wide peaks go on the chunk's last entry, not on every row
+    assert 'peak_rss_bytes' not in entries[0]
+    assert entries[-1]['peak_tensor_bytes'] == 4096
+    assert entries[-1]['pid'] == os.getpid()
+
+
+def test_run_variants_keeps_garment_order(stub_models):
+    Image = pytest.importorskip('PIL.Image')
+    person = Image.new('RGB', (8, 8), (200, 180, 160))
+    garments = [(Image.new('RGB', (8, 8), color), {'enhance': False})
+                for color in [(0, 0, 255), (0, 255, 0), (10, 20, 30)]]
+
+    results = batch_tryon.run_variants(stub_models, person, garments)
+
+    assert results == [clothes for clothes, _ in garments]
+    assert stub_models['segmentation'].calls == 1
+
+
+def test_shared_models_are_released_after_run(tmp_path, monkeypatch):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip("model sharing needs the fork start method")
+
+    class FailingPool:
+        def __init__(self, **kwargs):
+            assert batch_tryon._worker_models == {'loaded': 'cpu'}
+
+        def __enter__(self):
+            raise RuntimeError("pool failed")
+
+        def __exit__(self, *exc_info):
+            return False
+
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text("person,clothes\np.jpg,c.jpg\n", encoding='utf-8')
+    monkeypatch.setattr(batch_tryon, 'load_models', lambda device: {'loaded': device})
+    monkeypatch.setattr(batch_tryon, 'ProcessPoolExecutor', FailingPool)
+
+    with pytest.raises(RuntimeError, match="pool failed"):
+        batch_tryon.run_batch(str(manifest), str(tmp_path / 'out'), share_models=True)
+
+    # A later run, e.g. on another device, must load its own models
+    assert batch_tryon._worker_models is None
+    assert gc.get_freeze_count() == 0
+
+
+def test_make_chunks_keeps_people_together():
+    jobs = [{'id': str(i), 'person': person} for i, person in enumerate('aabcbaa')]
+
+    chunks = make_chunks(jobs, chunk_size=4)
+
+    assert [[job['id'] for job in chunk] for chunk in chunks] == [
+        ['0', '1', '5', '6'],
+        ['2', '4', '3'],
+    ]
+
+
+def test_make_chunks_splits_large_groups():
+    jobs = [{'id': str(i), 'person': 'a'} for i in range(5)] + [{'id': '5', 'person': 'b'}]
+
+    chunks = make_chunks(jobs, chunk_size=2)
+
+    assert [[job['id'] for job in chunk] for chunk in chunks] == [
+        ['0', '1'], ['2', '3'], ['4', '5'],
+    ]
@@ -0,0 +1,128 @@
+"""
+Tests for the staged decode -> infer -> encode pipeline
+"""
+import threading
+import time
+
+import pytest
+
+from io_pipeline import StagedPipeline
+
+
+def _pipeline_threads():
+    return [t for t in threading.enumerate() if t.name.startswith('pipeline-')]
+
+
+def test_results_keep_input_order():
+    # Later items decode faster, so the stages finish out of order
+    def decode(item):
+        time.sleep((10 - item) * 0.002)
+        return item
+
+    pipeline = StagedPipeline(decode, lambda x: x * 10, lambda item, output: output + 1,
+                              decode_workers=4, encode_workers=4)
+
+    results = list(pipeline.run(range(10)))
+
+    assert [item for item, _, _ in results] == list(range(10))
+    assert [output for _, output, _ in results] == [i * 10 + 1 for i in range(10)]
+    assert all(error is None for _, _, error in results)
+
+
+def test_errors_are_reported_per_item():
+    def decode(item):
+        if item == 1:
+            raise IOError("bad image")
+        return item
+
+    def infer(item):
+        if item == 2:
+            raise RuntimeError("model failed")
+        return item
+
+    def encode(item, output):
+        if item == 3:
+            raise OSError("disk full")
+        return output
+
+    results = list(StagedPipeline(decode, infer, encode).run(range(5)))
+
+    assert [item for item, _, _ in results] == [0, 1, 2, 3, 4]
+    assert [output for _, output, _ in results] == [0, None, None, None, 4]
+    errors = [error for _, _, error in results]
+    assert errors[0] is None and errors[4] is None
+    assert isinstance(errors[1], IOError)
+    assert isinstance(errors[2], RuntimeError)
+    assert isinstance(errors[3], OSError)
+
+
+def test_iterator_failure_is_yielded_last():
+    def items():
+        yield 0
+        yield 1
+        raise ValueError("manifest broke")
+
+    results = list(StagedPipeline(lambda x: x, lambda x: x, lambda item, output: output).run(items()))
+
+    assert [(item, output) for item, output, _ in results[:2]] == [(0, 0), (1, 1)]
+    item, output, error = results[2]
+    assert item is None and output is None
+    assert isinstance(error, ValueError)
+    assert len(results) == 3
+
+
+def test_early_close_stops_the_stages():
+    pulled = []
+
+    def items():
+        for i in range(1000):
+            pulled.append(i)
+            yield i
+
+    pipeline = StagedPipeline(lambda x: x, lambda x: x, lambda item, output: output, queue_size=2)
+    results = pipeline.run(items())
+    assert next(results)[0] == 0
+    results.close()
+
+    assert len(pulled) < 20
+    assert not _pipeline_threads()
+
+
+def test_bounded_queues_apply_backpressure():
+    queue_size, decode_workers = 2, 2
+    release = threading.Event()
+    decoded = []
+    pulled = []
+
+    def items():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    def decode(item):
+        decoded.append(item)
+        return item
+
+    def infer(item):
+        release.wait()
+        return item
+
+    pipeline = StagedPipeline(decode, infer, lambda item, output: output,
+                              decode_workers=decode_workers, queue_size=queue_size)
+    results = pipeline.run(items())
+    consumer = threading.Thread(target=lambda: list(results))
+    consumer.start()
+    try:
+        time.sleep(0.5)
+        # One item in infer_fn, queue_size waiting and one held by the blocked feeder
+        assert len(pulled) <= queue_size + 2
+        assert len(decoded) <= queue_size + 2
+    finally:
+        release.set()
+        consumer.join(timeout=10)
+    assert len(pulled) == 100
+
+
+def test_queue_size_must_be_positive():
+    with pytest.raises(ValueError):
+        StagedPipeline(None, None, None, queue_size=0)
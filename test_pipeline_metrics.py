@@ -0,0 +1,33 @@
+"""
+Tests for the per-stage metrics in pipeline_metrics.py
+"""
+from pipeline_metrics import PipelineMetrics
+
+
+def test_render_prometheus():
+    metrics = PipelineMetrics(buckets=(0.1, 1.0))
+    metrics.observe('segment', 0.05)
+    metrics.observe('segment', 0.5)
+    metrics.observe('segment', 5.0, error=True)
+
+    text = metrics.render_prometheus()
+
+    assert 'tryon_stage_seconds_bucket{stage="segment",le="0.1"} 1' in text
+    assert 'tryon_stage_seconds_bucket{stage="segment",le="1.0"} 2' in text
+    assert 'tryon_stage_seconds_bucket{stage="segment",le="+Inf"} 3' in text
+    assert 'tryon_stage_seconds_sum{stage="segment"} 5.550000' in text
+    assert 'tryon_stage_seconds_count{stage="segment"} 3' in text
+    assert 'tryon_stage_errors_total{stage="segment"} 1' in text
+    # Nothing recorded, so neither gauge is rendered
+    assert 'peak_rss_bytes' not in text
+    assert 'peak_tensor_bytes' not in text
+
+    metrics.record_memory(rss_bytes=1024)
+    text = metrics.render_prometheus(prefix='batch')
+    assert 'batch_peak_rss_bytes 1024' in text
+    assert 'peak_tensor_bytes' not in text
+
+    metrics.record_memory(rss_bytes=512, tensor_bytes=2048)
+    text = metrics.render_prometheus(prefix='batch')
+    assert 'batch_peak_rss_bytes 1024' in text
+    assert 'batch_peak_tensor_bytes 2048' in text
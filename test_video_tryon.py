@@ -0,0 +1,116 @@
+"""
+Tests for the optical-flow mask propagation and video writing in video_tryon.py
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+pytest.importorskip('PIL')
+
+from video_tryon import MaskPropagator
+
+WIDTH, HEIGHT = 320, 240
+
+
+def _frames_with_moving_square(dx, dy, size=80, x=100, y=70):
+    """
+    Two frames with the same textured square, moved by (dx, dy) in the second
+    """
+    rng = np.random.RandomState(0)
+    texture = rng.randint(0, 256, (size, size, 3), dtype=np.uint8)
+    texture = cv2.GaussianBlur(texture, (5, 5), 0)
+
+    prev_frame = np.full((HEIGHT, WIDTH, 3), 90, dtype=np.uint8)
+    frame = prev_frame.copy()
+    prev_frame[y:y + size, x:x + size] = texture
+    frame[y + dy:y + dy + size, x + dx:x + dx + size] = texture
+
+    prev_mask = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    prev_mask[y:y + size, x:x + size] = 1
+    expected = np.zeros_like(prev_mask)
+    expected[y + dy:y + dy + size, x + dx:x + dx + size] = 1
+    return prev_frame, frame, prev_mask, expected
+
+
+def _iou(a, b):
+    a, b = a.astype(bool), b.astype(bool)
+    return (a & b).sum() / (a | b).sum()
+
+
+def test_mask_follows_translated_square():
+    prev_frame, frame, prev_mask, expected = _frames_with_moving_square(dx=6, dy=4)
+    propagator = MaskPropagator(WIDTH, HEIGHT)
+
+    moved = propagator.warp(prev_mask, propagator.maps(prev_frame, frame))
+
+    assert moved.dtype == np.uint8
+    assert set(np.unique(moved)) <= {0, 1}
+    # The propagated mask must land where the square moved to, not where it came from
+    assert _iou(moved, expected) > 0.85
+    assert _iou(moved, expected) > _iou(moved, prev_mask) + 0.1
+
+
+def test_bool_mask_keeps_dtype():
+    prev_frame, frame, prev_mask, expected = _frames_with_moving_square(dx=-5, dy=3)
+    propagator = MaskPropagator(WIDTH, HEIGHT)
+
+    moved = propagator.warp(prev_mask.astype(bool), propagator.maps(prev_frame, frame))
+
+    assert moved.dtype == bool
+    assert _iou(moved, expected) > 0.85
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, bool])
+def test_mask_edge_is_not_smeared_inward(dtype):
+    # Content shifts 5px to the right: the left 5 columns come from outside the frame
+    propagator = MaskPropagator(WIDTH, HEIGHT)
+    maps = (propagator.grid_x - 5, propagator.grid_y)
+    mask = np.zeros((HEIGHT, WIDTH), dtype=dtype)
+    mask[:, :10] = 1
+
+    moved = propagator.warp(mask, maps)
+
+    assert not moved[:, :5].any()
+    assert moved[:, 5:15].all()
+    assert not moved[:, 15:].any()
+
+
+class _StubSegmentation:
+    def segment_clothing_regions(self, person_img):
+        width, height = person_img.size
+        return np.ones((height, width), dtype=np.uint8), np.zeros((height, width), dtype=np.uint8)
+
+
+class _ResizingVITON:
+    """
+    Returns the person at half resolution, as a fixed-size model would
+    """
+
+    def warp_clothes(self, person_img, clothes_img):
+        return clothes_img
+
+    def fuse_features(self, person_img, warped_clothes, body_mask, clothing_mask):
+        width, height = person_img.size
+        return person_img.resize((width // 2, height // 2))
+
+
+def test_process_video_writes_every_frame_at_capture_size(tmp_path):
+    from PIL import Image
+    from video_tryon import VideoTryOn, read_frames
+
+    source = str(tmp_path / 'person.avi')
+    writer = cv2.VideoWriter(source, cv2.VideoWriter_fourcc(*'MJPG'), 10.0, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("MJPG video writer unavailable")
+    for i in range(25):
+        writer.write(np.full((48, 64, 3), i * 10, dtype=np.uint8))
+    writer.release()
+
+    output = str(tmp_path / 'result.avi')
+    video_tryon = VideoTryOn(_StubSegmentation(), _ResizingVITON(), keyframe_interval=5)
+    stats = video_tryon.process_video(source, Image.new('RGB', (16, 16)), output, fourcc='MJPG')
+
+    frames = [frame for _, frame in read_frames(output)]
+    assert stats['frames'] == 25
+    assert len(frames) == 25
+    assert frames[0].shape == (48, 64, 3)
@@ -0,0 +1,291 @@
+"""
+Video try-on with temporal mask propagation.
+
+Running segmentation and the garment warp on every frame is slow and makes
+the masks flicker. Instead, full segmentation and warp_clothes run only on
+keyframes. For the frames in between, dense optical flow carries the
+previous frame's masks and warped garment forward, and only fuse_features
+(plus optional post-processing) runs per frame.
+
+Frames stream through io_pipeline.StagedPipeline: a reader thread decodes,
+one inference thread keeps the propagation state, and a single encoder
+thread writes frames in order. Only a few frames are in memory at once, so
+memory use does not grow with video length.
+
+Usage:
+    python video_tryon.py person.mp4 clothes.jpg --output result.mp4 --keyframe-interval 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Add project root to path
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from batch_tryon import _positive_int
+from io_pipeline import StagedPipeline
+
+
+def read_frames(path):
+    """
+    Yield (index, BGR frame) pairs from a video file one at a time
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f"Could not open video: {path}")
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+class MaskPropagator:
+    """
+    Moves per-frame arrays from one frame to the next with dense optical flow
+    """
+
+    def __init__(self, width, height, downscale=2):
+        """
+        Args:
+            width, height: Frame size
+            downscale: Flow is estimated at 1/downscale resolution, then upsampled
+        """
+        self.size = (width, height)
+        self.flow_size = (max(1, width // downscale), max(1, height // downscale))
+        # Base sampling grid, built once and reused for every frame
+        self.grid_x, self.grid_y = np.meshgrid(
+            np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32)
+        )
+
+    def _gray(self, frame):
+        small = cv2.resize(frame, self.flow_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def maps(self, prev_frame, frame):
+        """
+        Return (map_x, map_y) that sample prev_frame content at frame positions
+
+        Backward flow (current -> previous) is used, so every output pixel
+        has exactly one source and remap leaves no holes.
+        """
+        flow = cv2.calcOpticalFlowFarneback(
+            self._gray(frame), self._gray(prev_frame), None,
+            pyr_scale=0.5, levels=3, winsize=15, iterations=3,
+            poly_n=5, poly_sigma=1.2, flags=0
+        )
+        scale_x = self.size[0] / self.flow_size[0]
+        scale_y = self.size[1] / self.flow_size[1]
+        flow = cv2.resize(flow, self.size, interpolation=cv2.INTER_LINEAR)
+        map_x = self.grid_x + flow[..., 0] * scale_x
+        map_y = self.grid_y + flow[..., 1] * scale_y
+        return map_x, map_y
+
+    @staticmethod
+    def warp(array, maps, interpolation=cv2.INTER_LINEAR):
+        """
+        Apply remap maps to a mask or image, keeping its dtype
+
+        Any 2-D array is treated as a mask, whatever its dtype: it is
+        sampled with nearest-neighbour and pixels flowing in from outside
+        the frame become 0, so mask values at the edge are never smeared
+        inward. interpolation is used for 3-D (image) arrays only, which
+        replicate their border instead.
+        """
+        map_x, map_y = maps
+        if array.ndim == 2:
+            source = array.astype(np.uint8) if array.dtype == bool else array
+            moved = cv2.remap(source, map_x, map_y, cv2.INTER_NEAREST,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            return moved.astype(bool) if array.dtype == bool else moved
+        return cv2.remap(array, map_x, map_y, interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+
+class VideoTryOn:
+    """
+    Applies one garment to every frame of a video using keyframe propagation
+    """
+
+    def __init__(self, segmentation, viton_model, processor=None, keyframe_interval=10):
+        """
+        Args:
+            segmentation: HumanSegmentation instance
+            viton_model: VITONModel instance
+            processor: Optional ImageProcessor; when given, the post-processing
+                steps from test_full_pipeline run on every frame
+            keyframe_interval: Run full segmentation and warp every N frames
+        """
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+
+        self.segmentation = segmentation
+        self.viton_model = viton_model
+        self.processor = processor
+        self.keyframe_interval = keyframe_interval
+        self.stats = {'frames': 0, 'keyframes': 0}
+        self._state = None
+
+    def reset(self):
+        """
+        Forget the propagation state, e.g. before starting another video
+        """
+        self._state = None
+        self.stats = {'frames': 0, 'keyframes': 0}
+
+    def process_frame(self, index, frame, clothes_img):
+        """
+        Return the try-on result for one BGR frame as a BGR array
+
+        Frames must be passed in order, because the masks and warped garment
+        are propagated from the previous frame. The result is resized back
+        to the frame's size if the models returned another resolution.
+        """
+        person_img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        state = self._state
+
+        if state is None or index % self.keyframe_interval == 0:
+            body_mask, clothing_mask = self.segmentation.segment_clothing_regions(person_img)
+            warped_clothes = self.viton_model.warp_clothes(person_img, clothes_img)
+            if state is None:
+                height, width = frame.shape[:2]
+                propagator = MaskPropagator(width, height)
+            else:
+                propagator = state['propagator']
+            self.stats['keyframes'] += 1
+        else:
+            propagator = state['propagator']
+            maps = propagator.maps(state['frame'], frame)
+            body_mask = propagator.warp(state['body_mask'], maps)
+            clothing_mask = propagator.warp(state['clothing_mask'], maps)
+            warped_clothes = self._warp_garment(state['warped_clothes'], maps, frame.shape[:2])
+
+        self._state = {
+            'frame': frame,
+            'body_mask': body_mask,
+            'clothing_mask': clothing_mask,
+            'warped_clothes': warped_clothes,
+            'propagator': propagator,
+        }
+        self.stats['frames'] += 1
+
+        result_image = self.viton_model.fuse_features(
+            person_img, warped_clothes, body_mask, clothing_mask
+        )
+        if self.processor is not None:
+            result_image = self.processor.preserve_face_features(person_img, result_image)
+            result_image = self.processor.maintain_skin_tone(person_img, result_image, body_mask)
+            result_image = self.processor.enhance_realism(result_image, clothing_mask, body_mask)
+
+        result = cv2.cvtColor(np.asarray(result_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        height, width = frame.shape[:2]
+        if result.shape[:2] != (height, width):
+            result = cv2.resize(result, (width, height), interpolation=cv2.INTER_LINEAR)
+        return result
+
+    @staticmethod
+    def _warp_garment(warped_clothes, maps, frame_shape):
+        """
+        Move the keyframe's warped garment with the flow, keeping its type
+        """
+        is_pil = isinstance(warped_clothes, Image.Image)
+        array = np.asarray(warped_clothes)
+        if array.shape[:2] != frame_shape:
+            # Not in frame coordinates; fuse_features places it itself
+            return warped_clothes
+        moved = MaskPropagator.warp(array, maps, cv2.INTER_LINEAR)
+        return Image.fromarray(moved) if is_pil else moved
+
+    def process_video(self, video_path, clothes_img, output_path, fourcc='mp4v'):
+        """
+        Stream a video through the try-on pipeline and write the result
+
+        Returns a dict with frame counts and throughput.
+        """
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise IOError(f"Could not open video: {video_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        capture.release()
+
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+        if not writer.isOpened():
+            raise IOError(f"Could not open video writer: {output_path}")
+
+        def write(item, result):
+            # VideoWriter silently drops frames of any other size
+            if result.shape[:2] != (height, width):
+                raise ValueError(f"frame is {result.shape[1]}x{result.shape[0]}, "
+                                 f"writer expects {width}x{height}")
+            writer.write(result)
+
+        self.reset()
+        # One encoder thread so frames are written in submission order
+        pipeline = StagedPipeline(
+            decode_fn=lambda item: item,
+            infer_fn=lambda item: self.process_frame(item[0], item[1], clothes_img),
+            encode_fn=write,
+            decode_workers=1,
+            encode_workers=1,
+        )
+
+        start = time.perf_counter()
+        try:
+            for item, _, error in pipeline.run(read_frames(video_path)):
+                if error is not None:
+                    where = f"Frame {item[0]}" if item is not None else "Video decoding"
+                    raise RuntimeError(f"{where} failed: {error}") from error
+        finally:
+            writer.release()
+
+        elapsed = time.perf_counter() - start
+        return dict(self.stats, seconds=elapsed,
+                    fps=self.stats['frames'] / elapsed if elapsed else 0.0)
+
+
+def main():
+    """
+    Command-line entry point
+    """
+    parser = argparse.ArgumentParser(description="Apply a garment to every frame of a video")
+    parser.add_argument('video', help="Input video of a person")
+    parser.add_argument('clothes', help="Garment image")
+    parser.add_argument('--output', default='video_result.mp4', help="Output video path")
+    parser.add_argument('--keyframe-interval', type=_positive_int, default=10,
+                        help="Run full segmentation and warp every N frames")
+    parser.add_argument('--device', default='cpu', help="Device passed to HumanSegmentation")
+    parser.add_argument('--no-postprocess', action='store_true',
+                        help="Skip face/skin/realism post-processing on each frame")
+    args = parser.parse_args()
+
+    from utils.segmentation import HumanSegmentation
+    from utils.virtual_tryon import VITONModel
+    from utils.image_processing import ImageProcessor
+
+    video_tryon = VideoTryOn(
+        HumanSegmentation(device=args.device),
+        VITONModel(),
+        None if args.no_postprocess else ImageProcessor(),
+        keyframe_interval=args.keyframe_interval,
+    )
+    clothes_img = Image.open(args.clothes).convert('RGB')
+
+    stats = video_tryon.process_video(args.video, clothes_img, args.output)
+    print(f"Processed {stats['frames']} frames ({stats['keyframes']} keyframes) "
+          f"in {stats['seconds']:.2f}s ({stats['fps']:.2f} frames/sec)")
+    print(f"Result saved as '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()